@@ -0,0 +1,68 @@
+from scheduler import RateScheduler
+
+# what the car does while the controller is late with its next command
+FALLBACK_HOLD = "hold"    # nothing is sent, Unity keeps driving with the last command
+FALLBACK_BRAKE = "brake"  # the stepping thread sends speed 0 until the next command
+
+class Controller:
+    """
+    Base class for controllers driving the racecar.
+
+    A controller keeps all of its state on the instance, so several of them can
+    run in one process. step() takes the lidar samples and returns the action
+    as (speed, angle). Controllers that batch over agents accept a
+    (num_agents, samples) array and return a (num_agents, 2) array instead.
+    """
+    __slots__ = ()
+    num_agents = 1  # agents one step() call drives
+
+    def reset(self):
+        """
+        Clears the controller state, called at the start of every episode.
+        """
+
+    def step(self, obs):
+        raise NotImplementedError
+
+def run_controller(racecar, controller, period=0.1, fallback=FALLBACK_HOLD):
+    """
+    Drives racecar with controller every period seconds until interrupted.
+
+    fallback is what happens while a step overruns its deadline. With "hold"
+    nothing changes, the car keeps the last command. With "brake" the
+    stepping thread sends speed 0 once the next command is half a period
+    late, until the controller sets a new one.
+
+    A controller with num_agents > 1 gets the (num_agents, samples) scans of
+    every agent in one step() call and its (num_agents, 2) actions are sent
+    to the agents in the same order.
+    """
+    assert fallback in (FALLBACK_HOLD, FALLBACK_BRAKE), f"unknown fallback ({fallback})"
+    scheduler = RateScheduler(period)
+    racecar.command_timeout = 1.5 * period if fallback == FALLBACK_BRAKE else None
+    scan = None
+
+    def tick():
+        nonlocal scan
+        # reuse the scan array from the previous tick
+        scan = racecar.lidar.get_samples(out=scan)
+        speed, angle = controller.step(scan)
+        racecar.set_speed_and_angle(speed, angle)
+
+    def tick_batched():
+        nonlocal scan
+        scan, agent_ids = racecar.lidar.get_scans(out=scan)
+        if len(scan) != controller.num_agents:
+            return  # no scans from every agent yet
+        racecar.set_actions(controller.step(scan))
+
+    controller.reset()
+    racecar.start(type(controller).__name__)
+
+    try:
+        scheduler.run(tick_batched if controller.num_agents > 1 else tick)
+
+    except KeyboardInterrupt:
+        # Close the environment when the script is interrupted
+        print(f"Control loop: {scheduler.summary()}")
+        racecar.close()
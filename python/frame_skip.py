@@ -0,0 +1,70 @@
+from mlagents_envs.base_env import ActionTuple
+from work_buffers import WorkBuffers
+import numpy as np
+
+# ways of combining the lidar scans seen during skipped frames
+POOL_LAST = "last"    # keep only the most recent scan
+POOL_MAX = "max"      # element-wise max over the skipped frames
+POOL_STACK = "stack"  # keep every scan, (max_frames, samples) per agent
+POOLING_MODES = (POOL_LAST, POOL_MAX, POOL_STACK)
+
+class FrameRepeater:
+    """
+    Repeats one action per agent over several env.step() calls and pools the
+    lidar scans seen on the way.
+
+    RacecarMLAgent runs it next to a UnityEnvironment it launched itself, and
+    SimServer runs it next to its environment so an attached client steps k
+    frames with one socket round trip instead of 3 or more per frame.
+
+    Each env.step() is one exchange with Unity, which then runs the physics
+    until the next decision is requested (DecisionPeriod 5 on Player.prefab,
+    the car keeps driving with the last action in between). Repeating the
+    action here saves controller work per decision, not gRPC exchanges.
+    """
+    def __init__(self, behavior_name, pooling=POOL_LAST, max_frames=1):
+        assert pooling in POOLING_MODES, f"pooling ({pooling}) must be one of {POOLING_MODES}"
+        self.behavior_name = behavior_name
+        self.pooling = pooling
+        self.max_frames = max_frames
+        self.buffers = WorkBuffers()
+
+    def step(self, env, actions, frames):
+        """
+        Sends actions, a (num_agents, 2) array of (angle, speed) rows in agent
+        order (a single row is sent to every agent), for frames env.step() calls.
+
+        Returns (agent_ids, physics, lidar): the agent ids, their latest
+        (num_agents, 6) linear acceleration and angular velocity, and their
+        pooled (num_agents, rows, samples) scans, where rows is max_frames with
+        "stack" pooling (the first frames rows are valid) and 1 otherwise.
+        The arrays are work buffers overwritten by the next call.
+        """
+        for frame in range(frames):
+            decision_steps, terminal_steps = env.get_steps(self.behavior_name)
+            obs = decision_steps.obs[0]
+            agent_ids = decision_steps.agent_id
+            num_agents = len(agent_ids)
+
+            physics = self.buffers.get("physics", (num_agents, 6))
+            np.copyto(physics, obs[:, :6])
+            self._pool_lidar(frame, obs[:, 6:])
+
+            if len(actions) != num_agents:
+                actions = np.repeat(actions[:1], num_agents, axis=0)
+            env.set_actions(self.behavior_name, ActionTuple(continuous=actions))
+
+            # Step the environment
+            env.step()
+
+        return agent_ids, physics, self.buffers.buffers["lidar"]
+
+    def _pool_lidar(self, frame, scans):
+        rows = self.max_frames if self.pooling == POOL_STACK else 1
+        pooled = self.buffers.get("lidar", (len(scans), rows, scans.shape[1]))
+        if self.pooling == POOL_STACK:
+            np.copyto(pooled[:, frame], scans)
+        elif self.pooling == POOL_MAX and frame > 0:
+            np.maximum(pooled[:, 0], scans, out=pooled[:, 0])
+        else:
+            np.copyto(pooled[:, 0], scans)
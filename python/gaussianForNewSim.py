@@ -1,6 +1,8 @@
 # Example usage of RacecarMLAgent class:
-import time
-from racecar_ml_agent import RacecarMLAgent
+from racecar_ml_agent import connect
+from controller import Controller, run_controller
+from lidar_filter import TemporalLidarFilter, has_data
+from work_buffers import WorkBuffers
 import os
 import numpy as np
 import matplotlib.pyplot as plt
@@ -10,10 +12,19 @@ parent_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 print("Parent directory path:", parent_directory)
 
 env_path = parent_directory + "/Builds/sim"
-racecar = RacecarMLAgent(env_path, time_scale=1.0)
 
-speed = 0
-angle = 0
+SHOW_PLOT = True
+TEMPORAL_SCANS = 0 # Number of scans the temporal lidar filter averages over, 0 to disable it
+NUM_HEADINGS = 360 # Headings the direction search scores, raise it for a finer steering angle
+# Pyramid level the direction search starts on, None for the exhaustive search.
+# Level 1 picks the same heading as the exhaustive search on 95%+ of the corridor maps
+# in test_coarse_search.py (deeper levels drift further). It samples a quarter as many
+# points, so it pays off once NUM_HEADINGS is raised: with 1440-2880 headings and a
+# radius of 40+ cells it is 15-40% faster. With 360 headings the extra numpy calls cost more
+# than they save, and at radius 8 one coarse cell spans ~14 degrees, so the refined
+# sectors are too wide to be faster at any heading count
+COARSE_LEVEL = None
+COARSE_SLACK = 1  # coarse cells a candidate heading's peak may trail the best one by
 
 
 ########################################################################################
@@ -25,10 +36,52 @@ class GaussianMap:
         self.y_res = y_res
         self.sigma = sigma
         self.decay_rate = decay_rate
-        self.gaussian_map = np.zeros((x_res, y_res))
+        self.buffers = WorkBuffers()
+        self.gaussian_map = self.buffers.get("gaussian_map", (x_res, y_res))
         self.x_center = x_res // 2
         self.y_center = y_res // 2
-    
+
+        # Create a Gaussian template within a limited radius
+        self.template_radius = int(3 * self.sigma)
+        radius = self.template_radius
+        xv, yv = np.meshgrid(np.arange(-radius, radius + 1), np.arange(-radius, radius + 1))
+        self.gaussian_template = np.exp(-(xv ** 2 + yv ** 2) / (2 * self.sigma ** 2)).astype(np.float32)
+
+        # Max-pooled windows of the map, (level, rows, cols) -> pooled blocks.
+        # A window is only pooled when pooled_window() asks for it, and only
+        # once after every map update
+        self.pooled = {}
+        self.fresh_windows = set()
+
+    def clear(self):
+        self.gaussian_map.fill(0.0)
+        self.fresh_windows.clear()
+
+    def pooled_window(self, level, rows, cols):
+        """
+        Returns the map rows and cols (both (start, stop) in map cells,
+        multiples of 2 ** level) max-pooled level times over 2x2 blocks.
+        The search only reads the cells around the car, so the rest of the
+        map is never pooled.
+        """
+        key = (level, rows, cols)
+        if key in self.fresh_windows:
+            return self.pooled[key]
+
+        finer = self.gaussian_map[rows[0]:rows[1], cols[0]:cols[1]]
+        for k in range(1, level + 1):
+            height, width = finer.shape[0] // 2, finer.shape[1] // 2
+            # Pool row pairs first, their rows are contiguous, then column pairs
+            row_pooled = self.buffers.get(("row_pooled", key, k), (height, 2 * width))
+            coarser = self.buffers.get(("pooled", key, k), (height, width))
+            np.maximum(finer[0::2], finer[1::2], out=row_pooled)
+            np.maximum(row_pooled[:, 0::2], row_pooled[:, 1::2], out=coarser)
+            finer = coarser
+
+        self.pooled[key] = finer
+        self.fresh_windows.add(key)
+        return finer
+
     # Vectorized function
     def apply_gaussian(self, distance, angle):
         if distance == 0:
@@ -44,25 +97,36 @@ class GaussianMap:
     
     def update_gaussian_map(self, lidar_samples):
         # Modify #1: 
-        # Reset the Gaussian map with zeros array
-        self.gaussian_map = np.zeros((self.x_res, self.y_res))
+        # Reset the Gaussian map in place
+        self.gaussian_map.fill(0.0)
 
         num_samples = len(lidar_samples)
-        angles = np.linspace(0, 2 * np.pi, num_samples)
-
-        # Create a Gaussian template within a limited radius
-        radius = int(3 * self.sigma)
-        xv, yv = np.meshgrid(np.arange(-radius, radius + 1), np.arange(-radius, radius + 1))
-        gaussian_template = np.exp(-(xv ** 2 + yv ** 2) / (2 * self.sigma ** 2))
+        cos_angles = self.buffers.constant(("cos_angles", num_samples),
+                                           lambda: np.cos(np.linspace(0, 2 * np.pi, num_samples)).astype(np.float32))
+        sin_angles = self.buffers.constant(("sin_angles", num_samples),
+                                           lambda: np.sin(np.linspace(0, 2 * np.pi, num_samples)).astype(np.float32))
+
+        # Map position of every lidar sample, truncated like int()
+        offsets = self.buffers.get("sample_offsets", (num_samples,))
+        xs = self.buffers.get("sample_xs", (num_samples,), np.intp)
+        ys = self.buffers.get("sample_ys", (num_samples,), np.intp)
+        np.multiply(lidar_samples, cos_angles, out=offsets)
+        np.subtract(self.y_center, offsets, out=offsets)
+        np.copyto(ys, offsets, casting="unsafe")
+        np.multiply(lidar_samples, sin_angles, out=offsets)
+        np.subtract(self.x_center, offsets, out=offsets)
+        np.copyto(xs, offsets, casting="unsafe")
+
+        radius = self.template_radius
+        gaussian_template = self.gaussian_template
 
         # Apply the Gaussian template at each lidar sample point
-        for i, distance in enumerate(lidar_samples):
-            if distance == 0:
+        for i in range(num_samples):
+            if lidar_samples[i] == 0:
                 continue
 
-            angle = angles[i]
-            y = int(self.y_center - distance * np.cos(angle))
-            x = int(self.x_center - distance * np.sin(angle))
+            y = int(ys[i])
+            x = int(xs[i])
 
             # Check if the point is within bounds
             if 0 <= x < self.x_res and 0 <= y < self.y_res:
@@ -81,6 +145,8 @@ class GaussianMap:
                 # Accumulate Gaussian data within the bounds
                 self.gaussian_map[y_start:y_end, x_start:x_end] += gaussian_template[template_y_start:template_y_end, template_x_start:template_x_end]
 
+        self.fresh_windows.clear()
+
 
     def visualize_gaussian_map(self, optimal_angle, radius):
         plt.clf()  # Clear the previous figure
@@ -109,149 +175,296 @@ class GaussianMap:
 ########################################################################################
 # PathPlanner Class
 ########################################################################################
+# The planner searches num_headings headings spread evenly over -180 to 0 degrees
+# relative to the car's heading
+RAY_SAMPLES = 60  # points sampled along every heading on the full resolution map
+
 class PathPlanner:
-    def __init__(self, gaussian_map, x_center, y_center):
+    def __init__(self, gaussian_map, x_center, y_center, num_headings=NUM_HEADINGS):
         self.gaussian_map = gaussian_map  # 2D Gaussian heatmap
         self.x_center = x_center
         self.y_center = y_center
+        self.headings = np.linspace(-180, 0, num_headings)
+        self.buffers = WorkBuffers()
+
+    def _ray_samples(self, radius, scale=1):
+        """
+        Returns the x and y cells of the RAY_SAMPLES // scale points sampled from
+        the center to the half-circle along every scale-th heading, on a map
+        scale times coarser than the Gaussian map.
+        """
+        angle_rad = np.radians(self.headings[::scale])
+        x_center = self.x_center / scale
+        y_center = self.y_center / scale
+
+        # Calculate the end point of the line on the circle
+        x_end = x_center + radius / scale * np.cos(angle_rad)
+        y_end = y_center + radius / scale * np.sin(angle_rad)
+
+        # Sample the points from the center to the end point, truncated like int()
+        x_samples = np.linspace(x_center, x_end, RAY_SAMPLES // scale, axis=1).astype(np.intp)
+        y_samples = np.linspace(y_center, y_end, RAY_SAMPLES // scale, axis=1).astype(np.intp)
+        return x_samples, y_samples
+
+    def _ray_window(self, level, radius):
+        """
+        Returns the flat indices of the ray samples on a pyramid level into the
+        window they read, a mask of the samples outside the map (None when every
+        sample is inside), and the window as (rows, cols) of the full resolution
+        map (None for the whole map).
+        """
+        scale = 2 ** level
+        x_samples, y_samples = self._ray_samples(radius, scale)
+        height, width = self.gaussian_map.gaussian_map.shape
+        height, width = height // scale, width // scale
+        inside = (0 <= x_samples) & (x_samples < width) & (0 <= y_samples) & (y_samples < height)
+
+        window = None
+        if level > 0:
+            # Smallest block-aligned window holding every sample inside the map
+            y_start, x_start = y_samples[inside].min(), x_samples[inside].min()
+            height = y_samples[inside].max() + 1 - y_start
+            width = x_samples[inside].max() + 1 - x_start
+            window = ((int(y_start) * scale, int(y_start + height) * scale),
+                      (int(x_start) * scale, int(x_start + width) * scale))
+            y_samples = y_samples - y_start
+            x_samples = x_samples - x_start
+
+        ray_indices = np.where(inside, y_samples * width + x_samples, 0)
+        outside = np.ascontiguousarray(~inside) if not inside.all() else None
+        return np.ascontiguousarray(ray_indices), outside, window
+
+    def _ray_tables(self, level, radius, gamma):
+        """
+        Returns the map the rays on a pyramid level read and their cached
+        sample indices, outside mask and gamma ** idx weights.
+        """
+        ray_indices, outside, window = self.buffers.constant(("rays", level, radius),
+                                                             lambda: self._ray_window(level, radius))
+        if window is None:
+            level_map = self.gaussian_map.gaussian_map
+        else:
+            level_map = self.gaussian_map.pooled_window(level, *window)
+
+        # gamma ** idx for the idx-th point of a ray, expanded to every ray so the
+        # multiply below does not need a broadcasting buffer. A coarse sample
+        # stands for 2 ** level full resolution samples, so it is discounted as much
+        def discounts():
+            idx = np.arange(1, ray_indices.shape[1] + 1) * 2 ** level
+            return np.tile((gamma ** idx).astype(np.float32), (len(ray_indices), 1))
+        weights = self.buffers.constant(("ray_weights", level, gamma, ray_indices.shape), discounts)
+        return level_map, ray_indices, outside, weights
+
+    def _ray_peaks(self, radius, gamma, level=0):
+        """
+        Returns the index of the highest discounted value along every ray on
+        a pyramid level, the full resolution map by default.
+        """
+        level_map, ray_indices, outside, weights = self._ray_tables(level, radius, gamma)
+
+        # Discounted Gaussian values at the samples of every ray, points outside the map never win
+        ray_values = self.buffers.get(("ray_values", level), ray_indices.shape)
+        np.take(level_map.ravel(), ray_indices, out=ray_values, mode="wrap")
+        np.multiply(ray_values, weights, out=ray_values)
+        if outside is not None:
+            np.copyto(ray_values, -np.inf, where=outside)
+
+        peak_indices = self.buffers.get(("ray_peaks", level), (len(ray_indices),), np.intp)
+        np.argmax(ray_values, axis=1, out=peak_indices)
+        return peak_indices
 
-    def find_optimal_direction(self, radius, gamma=0.99):
+    def _ray_peaks_at(self, radius, gamma, headings):
+        """
+        Same as _ray_peaks on the full resolution map, for the given heading
+        indices only. The peaks are overwritten by the next call.
+        """
+        level_map, ray_indices, outside, weights = self._ray_tables(0, radius, gamma)
+        count = len(headings)
+
+        # The first count rows of buffers sized for every heading
+        rays = self.buffers.get("refine_rays", ray_indices.shape, np.intp)[:count]
+        ray_values = self.buffers.get("refine_values", ray_indices.shape)[:count]
+        np.take(ray_indices, headings, axis=0, out=rays, mode="clip")
+        np.take(level_map.ravel(), rays, out=ray_values, mode="wrap")
+        np.multiply(ray_values, weights[:count], out=ray_values)
+        if outside is not None:
+            refine_outside = self.buffers.get("refine_outside", outside.shape, np.bool_)[:count]
+            np.take(outside, headings, axis=0, out=refine_outside, mode="clip")
+            np.copyto(ray_values, -np.inf, where=refine_outside)
+
+        peak_indices = self.buffers.get("refine_peaks", (len(ray_indices),), np.intp)[:count]
+        np.argmax(ray_values, axis=1, out=peak_indices)
+        return peak_indices
+
+    def find_optimal_direction(self, radius, gamma=0.99, coarse_level=None, refine_width=None):
         """
         Find the optimal direction to go based on the Gaussian map within a half-ciracecarle.
         Parameters:
             x_center, y_center: Center position of the car.
             radius: Radius of the half-ciracecarle in front of the car.
+            coarse_level: When set, every 2 ** coarse_level-th heading is first
+                scored on this pyramid level, and only the best coarse sectors
+                are scored on the full map, refine_width headings past their
+                edges (by default the headings one coarse cell spans at radius).
         Returns:
             optimal_direction: Angle (in degrees) of the optimal direction to go.
         """
-        gaussian_map = self.gaussian_map.gaussian_map  # Assuming a 2D array of Gaussian values
-        optimal_values = []  # To store summed Gaussian values for each angle
+        if coarse_level is None:
+            # Find the direction whose highest value comes first
+            optimal_index = np.argmin(self._ray_peaks(radius, gamma))
+        else:
+            optimal_index = self._coarse_to_fine(radius, gamma, coarse_level, refine_width)
 
-        """ Original code begin
-        """
-        # Iterate over the 180-degree half-ciracecarle in front (360 points for finer resolution)
-        for angle_deg in np.linspace(-180, 0, 360):  # -180 to 0 degrees relative to the car's heading
-            angle_rad = np.radians(angle_deg)
-            # print("angle_rad: ", angle_rad)
-            
-            # Calculate the end point of the line on the ciracecarle
-            x_end = self.x_center + radius * np.cos(angle_rad)
-            # print("x_end: ", x_end)
-            y_end = self.y_center + radius * np.sin(angle_rad)
-            # print("y_end: ", y_end)
-            
-            # Sample 50 points from the end point to the center
-            x_samples = np.linspace(self.x_center, x_end, 60)
-            # print("x_samples: ", x_samples)
-            y_samples = np.linspace(self.y_center, y_end, 60)
-            # print("y_samples: ", y_samples)
-            # Get the Gaussian values at each sampled point
-            gaussian_values = []
-            # for x, y in zip(x_samples, y_samples):
-            for idx, (x, y) in enumerate(zip(x_samples, y_samples), start=1):
-                # Ensure the points are within bounds of the gaussian_map
-                if 0 <= int(x) < gaussian_map.shape[1] and 0 <= int(y) < gaussian_map.shape[0]:
-                    # rather than this i calculate it gaussian_map[int(y), int(x)]
-                    gaussian_values.append(gaussian_map[int(y), int(x)] * (gamma ** idx))
-                    # print("gaussian values: ", gaussian_values)
-                    # gaussian_values.append(gaussian_map[int(y), int(x)])
-            
-            # Sum the Gaussian values for this direction
-            total_value = np.argmax(gaussian_values)
-            optimal_values.append(total_value)
-
-            # print("total_value: ", total_value)
-            # print("optimal_values: ", optimal_values[:10])
-
-        # Find the direction with the minimum Gaussian value
-        optimal_index = np.argmin(optimal_values)
-        optimal_direction = np.linspace(-180, 0, 360)[optimal_index]
+        optimal_direction = self.headings[optimal_index]
         # print("optimal direction: ", optimal_direction)
         # print("angle now: ", optimal_direction)
         
         return optimal_direction
 
-def update_lidar_and_visualize():
-    try:
-        lidar_samples = racecar.lidar.get_samples()  # Fetch new lidar data
-        # print("lidar sample: ", lidar_samples[:6])
-
-        if lidar_samples is not None:
-            start = time.time()
-            gaussian_map.update_gaussian_map(lidar_samples)  # Update heatmap
-            # print(time.time() - start)
-            # Calculate the optimal path
-            path_planner = PathPlanner(gaussian_map, gaussian_map.x_center, gaussian_map.y_center)
-            radius = 8
-            optimal_angle = path_planner.find_optimal_direction(radius)
-            control_car(optimal_angle, 0.5)
-            # control_car(0, 1)
-            # print("angle: ", optimal_angle)
-
-        gaussian_map.visualize_gaussian_map(optimal_angle, radius)  # Display the heatmap
+    def _coarse_to_fine(self, radius, gamma, coarse_level, refine_width):
+        """
+        Returns the index of the optimal heading, scoring the pyramid level first.
+        """
+        scale = 2 ** coarse_level
+        coarse_peaks = self._ray_peaks(radius, gamma, coarse_level)
+
+        # The peak index is a whole sample, so neighbouring headings often tie
+        # at the best coarse score. Every coarse heading tied with the best one,
+        # or trailing it by up to COARSE_SLACK coarse cells, is a candidate.
+        slack = COARSE_SLACK * RAY_SAMPLES / radius
+        candidates = self.buffers.get(("coarse_candidates", coarse_level), coarse_peaks.shape, np.bool_)
+        np.less_equal(coarse_peaks, coarse_peaks.min() + slack, out=candidates)
+
+        # Pooling and the coarser sampling move the edges of a run of candidates
+        # by about a coarse cell at the end of the rays. Every heading that close
+        # to the first or last candidate of a run is scored on the full map, in
+        # between the run only the headings the coarse level scored.
+        if refine_width is None:
+            refine_width = int(np.ceil(scale * len(self.headings) / (np.pi * radius)))
+        refined = self.buffers.get(("refined", coarse_level), (len(self.headings),), np.bool_)
+        refined.fill(False)
+        refined[::scale] = candidates
+        padded = self.buffers.get(("padded_candidates", coarse_level), (len(candidates) + 2,), np.int8)
+        padded[1:-1] = candidates
+        for edge in np.flatnonzero(np.diff(padded)):
+            # a run starts at edge or ends at edge - 1
+            refined[max((edge - 1) * scale - refine_width, 0):edge * scale + refine_width + 1] = True
+
+        headings = np.flatnonzero(refined)
+        peaks = self._ray_peaks_at(radius, gamma, headings)
+        best = np.argmin(peaks)
+        best, best_peak = headings[best], peaks[best]
+
+        # Ties go to the lowest heading like in the exhaustive search, so the
+        # headings just below the best one that were skipped could still win
+        start = max(best - scale + 1, 0)
+        below = np.flatnonzero(~refined[start:best]) + start
+        if len(below):
+            below_peaks = self._ray_peaks_at(radius, gamma, below)
+            if below_peaks.min() <= best_peak:
+                best = below[np.argmin(below_peaks)]
+        return best
+
+    def coarse_search_error(self, radius, gamma=0.99, coarse_level=1, refine_width=None):
+        """
+        Returns how far (in degrees) the coarse-to-fine search lands from the
+        exhaustive search on the current map.
+        """
+        exhaustive = self.find_optimal_direction(radius, gamma)
+        coarse = self.find_optimal_direction(radius, gamma, coarse_level, refine_width)
+        return abs(coarse - exhaustive)
 
-    except ValueError as e:
-        print(f"Error fetching LiDAR samples: {e}. Skipping this update.")
-        
 ########################################################################################
-# Functions for update lidar and controlling the car
+# Functions for controlling the car
 ########################################################################################
-def control_car(optimal_angle, speed_local):
+def steering_from_direction(optimal_angle):
     """
-    Control the car based on the optimal direction calculated from LiDAR data.
+    Convert the optimal direction calculated from LiDAR data to a steering angle.
     """
-    global speed, angle
-    # Calculate the steering angle based on the optimal direction
-    # Assuming `optimal_angle` is the angle in radians to turn towards
     # Normalize the angle to fit within -1.0 (left) and 1.0 (right) for the steering
-    # optimal_angle_rad = np.radians(optimal_angle + 90)
-    # max_turn_angle = 0.610865  # 35 degrees, adjust as needed
     clipped_angle = np.clip(optimal_angle, -125, -55)
-    # if (optimal_angle <= 55):
-    #     angle = -1
-    # elif (optimal_angle >= 125):
-    #     angle = 1
-    # else:
-        # angle = normalize(optimal_angle, old_min, old_max, new_min, new_max)
-    angle = normalize(clipped_angle, old_min, old_max, new_min, new_max)
-    # normalized_angle = angle_cur / 70
-    # steering_angle = np.clip(optimal_angle, -1.0, 1.0)
-    # print(angle_cur, steering_angle)
-    # Example for normalizing a value
-    print(f"Optimal angle: {optimal_angle}, Speed: {speed_local}, Angle: {angle}")
-
-    # Send the control command to the car
-    speed = speed_local
-    # angle = steering_angle
+    return normalize(clipped_angle, old_min, old_max, new_min, new_max)
 
 old_min, old_max = -180, 0
 new_min, new_max = -1, 1
 def normalize(value, old_min, old_max, new_min, new_max):
     return ((value - old_min) / (old_max - old_min)) * (new_max - new_min) + new_min
-    
-def update():
-    global speed, angle
-    # Access Lidar data
-    # print(f"Lidar data: {lidar_data}")
-    
-    update_lidar_and_visualize()
 
-    # Custom logic to control the car based on Lidar data (change your speed and angle logic here)
+########################################################################################
+# GaussianPlanner Controller
+########################################################################################
+class GaussianPlanner(Controller):
+    """
+    Steers towards the direction with the lowest Gaussian map value.
+
+    Every agent has its own map, so a single GaussianPlanner can drive
+    num_agents cars: step() takes a (num_agents, samples) array of scans and
+    returns a (num_agents, 2) array of (speed, angle). A single 1D scan
+    returns a (speed, angle) tuple. Only the first agent's map is plotted.
+
+    With temporal_scans set, the lidar samples go through a TemporalLidarFilter
+    over that many scans before they are added to the map. With coarse_level
+    set, the direction search starts on that level of a max-pooled map pyramid.
+    PathPlanner.coarse_search_error checks its accuracy. num_headings is how
+    many headings the search scores.
+    """
+    __slots__ = ("num_agents", "gaussian_maps", "path_planners", "lidar_filter", "speed", "radius",
+                 "coarse_level", "show_plot", "action")
+
+    def __init__(self, num_agents=1, sigma=4.5, decay_rate=0.98, speed=0.5, radius=8, show_plot=SHOW_PLOT,
+                 temporal_scans=TEMPORAL_SCANS, coarse_level=COARSE_LEVEL, num_headings=NUM_HEADINGS):
+        self.num_agents = num_agents
+        self.gaussian_maps = [GaussianMap(sigma=sigma, decay_rate=decay_rate) for _ in range(num_agents)]
+        self.path_planners = [PathPlanner(gaussian_map, gaussian_map.x_center, gaussian_map.y_center, num_headings)
+                              for gaussian_map in self.gaussian_maps]
+        self.lidar_filter = TemporalLidarFilter(temporal_scans) if temporal_scans else None
+        self.speed = speed
+        self.radius = radius
+        self.coarse_level = coarse_level
+        self.show_plot = show_plot
+        self.reset()
+
+    def reset(self):
+        for gaussian_map in self.gaussian_maps:
+            gaussian_map.clear()
+        self.action = np.zeros((self.num_agents, 2), dtype=np.float32)  # (speed, angle)
+        if self.lidar_filter is not None:
+            self.lidar_filter.reset()
+
+    def step(self, obs):
+        if obs is None:
+            return tuple(self.action[0])
+
+        scans = np.atleast_2d(obs)
+        assert len(scans) == self.num_agents, f"expected {self.num_agents} scans, got {len(scans)}"
+        if self.lidar_filter is not None and has_data(scans):
+            scans = self.lidar_filter.update(scans)
+
+        for i, lidar_samples in enumerate(scans):
+            self._step_agent(i, lidar_samples)
+
+        if np.ndim(obs) == 1:
+            return tuple(self.action[0])
+        return self.action
+
+    def _step_agent(self, i, lidar_samples):
+        try:
+            self.gaussian_maps[i].update_gaussian_map(lidar_samples)  # Update heatmap
+            # Calculate the optimal path
+            optimal_angle = self.path_planners[i].find_optimal_direction(self.radius, coarse_level=self.coarse_level)
+            angle = steering_from_direction(optimal_angle)
+            print(f"Optimal angle: {optimal_angle}, Speed: {self.speed}, Angle: {angle}")
+            self.action[i] = (self.speed, angle)
+
+            if self.show_plot and i == 0:
+                self.gaussian_maps[i].visualize_gaussian_map(optimal_angle, self.radius)  # Display the heatmap
+
+        except ValueError as e:
+            print(f"Error fetching LiDAR samples: {e}. Skipping this update.")
 
 ## Do not modify the code below
 ## Unless you want to change the update sleep time or the setup and close logic
 if __name__ == "__main__":    
-    gaussian_map = GaussianMap(sigma=4.5, decay_rate=0.98)   
-    
-    try:
-        racecar.start()
-
-        while True:
-            update()
-            # Sleep for a short duration to simulate real-time control
-            racecar.set_speed_and_angle(speed, angle)
-            time.sleep(0.01)
-
-    except KeyboardInterrupt:
-        # Close the environment when the script is interrupted
-        racecar.close()
\ No newline at end of file
+    # attaches to the sim server if RACECAR_SIM_PORT is set
+    racecar = connect(env_path, time_scale=1.0)
+    run_controller(racecar, GaussianPlanner(sigma=4.5, decay_rate=0.98), period=0.01)
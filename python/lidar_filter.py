@@ -0,0 +1,146 @@
+from work_buffers import WorkBuffers
+import numpy as np
+
+def has_data(scans):
+    """
+    Returns whether every scan of scans, a (samples,) scan or a
+    (num_agents, samples) batch, has data. The simulator sends all-zero scans
+    until the lidar has run, those must not enter the ring.
+    """
+    scans = np.atleast_2d(scans)
+    return scans.size > 0 and bool(np.all(np.any(scans != 0, axis=1)))
+
+class TemporalLidarFilter:
+    """
+    Filters lidar noise over time using the last num_scans scans.
+
+    The scans are kept in a preallocated (num_scans, ...) ring buffer. The
+    running mean and variance of every sample are updated incrementally as
+    scans enter and leave the ring. Samples whose spread over the ring is much
+    larger than the simulated lidar noise (a dropout, or a wall edge moving
+    past) are flagged as outliers and take the median of the ring instead of
+    the mean.
+
+    Scans can be a single (samples,) array or a batch such as
+    (num_agents, samples), the ring keeps whatever shape it is given first.
+    """
+    def __init__(self, num_scans=5, noise_factor=0.02, outlier_threshold=3.0):
+        """
+        Args:
+            num_scans: Number of scans kept in the ring.
+            noise_factor: Relative standard deviation of the lidar range noise
+                (averageErrorFactor in Lidar.cs).
+            outlier_threshold: A sample is an outlier when its standard deviation
+                over the ring exceeds outlier_threshold * noise_factor * mean.
+        """
+        assert num_scans >= 1, f"num_scans ({num_scans}) must be at least 1"
+        self.num_scans = num_scans
+        self.noise_factor = noise_factor
+        self.outlier_threshold = outlier_threshold
+        self.buffers = WorkBuffers()
+        self.shape = None
+        self.reset()
+
+    def reset(self):
+        self.count = 0  # number of scans in the ring
+        self.index = 0  # slot the next scan is written to
+        if self.shape is not None:
+            self.sum.fill(0.0)
+            self.sum_sq.fill(0.0)
+
+    def _allocate(self, shape):
+        self.shape = shape
+        self.ring = self.buffers.get("ring", (self.num_scans,) + shape)
+        # float64 accumulators so the incremental updates do not drift
+        self.sum = self.buffers.get("sum", shape, np.float64)
+        self.sum_sq = self.buffers.get("sum_sq", shape, np.float64)
+        self.reset()
+
+    def update(self, scan):
+        """
+        Adds scan to the ring and returns the filtered scan. The returned array
+        is a work buffer that is overwritten by the next call. Check scans
+        with has_data() first, scans without data would be averaged in.
+        """
+        if scan.shape != self.shape:
+            self._allocate(scan.shape)
+
+        squared = self.buffers.get("squared", self.shape, np.float64)
+        slot = self.ring[self.index]
+
+        # Remove the oldest scan from the running sums
+        if self.count == self.num_scans:
+            np.subtract(self.sum, slot, out=self.sum)
+            np.multiply(slot, slot, out=squared, dtype=np.float64)
+            np.subtract(self.sum_sq, squared, out=self.sum_sq)
+        else:
+            self.count += 1
+
+        np.copyto(slot, scan)
+        np.add(self.sum, slot, out=self.sum)
+        np.multiply(slot, slot, out=squared, dtype=np.float64)
+        np.add(self.sum_sq, squared, out=self.sum_sq)
+
+        self.index = (self.index + 1) % self.num_scans
+        if self.index == 0:
+            self._recompute_sums()
+
+        return self.filtered()
+
+    def _recompute_sums(self):
+        """
+        Recomputes the running sums from the ring once per lap to drop the
+        rounding error the incremental updates accumulate.
+        """
+        squared = self.buffers.get("squared", self.shape, np.float64)
+        self.sum.fill(0.0)
+        self.sum_sq.fill(0.0)
+        for scan in self.ring[:self.count]:
+            np.add(self.sum, scan, out=self.sum)
+            np.multiply(scan, scan, out=squared, dtype=np.float64)
+            np.add(self.sum_sq, squared, out=self.sum_sq)
+
+    def mean(self):
+        mean = self.buffers.get("mean", self.shape)
+        np.divide(self.sum, self.count, out=mean, casting="unsafe")
+        return mean
+
+    def variance(self):
+        variance = self.buffers.get("variance", self.shape, np.float64)
+        squared_mean = self.buffers.get("squared", self.shape, np.float64)
+        np.divide(self.sum, self.count, out=squared_mean)
+        np.multiply(squared_mean, squared_mean, out=squared_mean)
+        np.divide(self.sum_sq, self.count, out=variance)
+        np.subtract(variance, squared_mean, out=variance)
+        # Rounding can leave tiny negative values
+        np.maximum(variance, 0.0, out=variance)
+        return variance
+
+    def median(self):
+        """
+        Returns the median of the ring, the upper one of the two middle values
+        when it holds an even number of scans.
+        """
+        ordered = self.buffers.get("ordered", self.ring.shape)
+        np.copyto(ordered, self.ring)
+        ordered[:self.count].partition(self.count // 2, axis=0)
+        return ordered[self.count // 2]
+
+    def outlier_mask(self):
+        """
+        Returns a mask of the samples whose spread over the ring is too large
+        to be lidar noise.
+        """
+        mask = self.buffers.get("outliers", self.shape, bool)
+        limit = self.buffers.get("limit", self.shape, np.float64)
+        np.abs(self.mean(), out=limit, casting="unsafe")
+        np.multiply(limit, self.outlier_threshold * self.noise_factor, out=limit)
+        np.multiply(limit, limit, out=limit)
+        np.greater(self.variance(), limit, out=mask)
+        return mask
+
+    def filtered(self):
+        filtered = self.buffers.get("filtered", self.shape)
+        np.copyto(filtered, self.mean())
+        np.copyto(filtered, self.median(), where=self.outlier_mask())
+        return filtered
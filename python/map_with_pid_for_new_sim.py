@@ -1,5 +1,9 @@
 # Example usage of RacecarMLAgent class:
-from racecar_ml_agent import RacecarMLAgent
+from racecar_ml_agent import connect
+from controller import Controller, run_controller
+from lidar_filter import TemporalLidarFilter, has_data
+from wall_segments import LEFT, Walls, find_wall_segments
+from work_buffers import WorkBuffers
 import sys, time, os
 import numpy as np
 import matplotlib.pyplot as plt
@@ -11,7 +15,6 @@ current_directory = os.path.dirname(os.path.abspath(__file__))
 print("Current directory path:", current_directory)
 
 env_path = current_directory + "/../Builds/sim"
-racecar = RacecarMLAgent(env_path, time_scale=1.0)
 
 ########################################################################################
 # Global variables
@@ -24,10 +27,7 @@ SHOW_PLOT = False
 
 # >> Constants
 WINDOW_SIZE = 8 # Window size to calculate the average distance
-
-# >> Variables
-speed = 0.0  # The current speed of the car
-angle = 0.0  # The current angle of the car's wheels
+TEMPORAL_SCANS = 0 # Number of scans the temporal lidar filter averages over, 0 to disable it
 
 # >> !!! TUNING VARIABLES !!!
 if IS_SIM:
@@ -46,20 +46,18 @@ else:
     KI = 0.0
     KD = 0.0
 
-prev_error_angle = 0  # Previous error for angle control
-integral_angle = 0  # Integral term for angle control
-
 # Initialize PID control variables for speed
 KP_speed = 0.1  # Proportional constant for speed
 KI_speed = 0.001  # Integral constant for speed
 KD_speed = 0.05  # Derivative constant for speed
-prev_error_speed = 0  # Previous error for speed control
-integral_speed = 0  # Integral term for speed control
 
 # Initialize desired speed
 desired_speed = 0.5  # Set desired speed to 0.5 (you can adjust this value)
 
-flag = 0
+# The car stops for STOP_TICKS updates out of every FLAG_PERIOD when the farthest point is close
+STOP_DISTANCE = 350
+STOP_TICKS = 30
+FLAG_PERIOD = 60
 
 ########################################################################################
 # Functions
@@ -123,6 +121,47 @@ def get_lidar_average_distance(
 
     return sum(samples) / len(samples)
 
+def get_lidar_average_distances(scan, window_angle, out, buffers):
+    """
+    Vectorized get_lidar_average_distance() for every whole degree 0 to 359.
+
+    Writes the average distances into out, a (360,) float32 array, using the
+    work buffers for the temporaries.
+    """
+    scan_length = scan.shape[0]
+    num_side_samples = int(window_angle / 2 * scan_length / 360)
+    width = 2 * num_side_samples + 1
+
+    # Indices of the window around every angle, one row per offset in the window,
+    # wrapping around the array edge
+    def window_indices():
+        center_indices = (np.arange(360) * scan_length / 360).astype(np.intp)
+        return (np.arange(-num_side_samples, num_side_samples + 1)[:, None] + center_indices) % scan_length
+    indices = buffers.constant(("window_indices", scan_length, width), window_indices)
+
+    samples = buffers.get("window_samples", (360,), scan.dtype)
+    valid = buffers.get("window_valid", (360,), bool)
+    sums = buffers.get("window_sums", (360,))
+    counts = buffers.get("window_counts", (360,))
+    has_samples = buffers.get("window_has_samples", (360,), bool)
+
+    # Accumulate one offset at a time, axis reductions over the whole
+    # window would allocate a temporary the size of the window
+    sums.fill(0.0)
+    counts.fill(0.0)
+    for offset_indices in indices:
+        np.take(scan, offset_indices, out=samples, mode="wrap")
+        # Samples with no data (0.0) are left out of the average
+        np.greater(samples, 0, out=valid)
+        np.maximum(samples, 0, out=samples)
+        np.add(sums, samples, out=sums)
+        np.add(counts, valid, out=counts)
+    np.greater(counts, 0, out=has_samples)
+
+    out.fill(0.0)
+    np.divide(sums, counts, out=out, where=has_samples)
+    return out
+
 def get_farthest_distance_in_range(scan, start, end):
     scan_size = len(scan)
     if start < 0:
@@ -137,23 +176,31 @@ def get_farthest_distance_in_range(scan, start, end):
 
     return np.max(values_in_range)
 
-def lidar_to_2d_coordinates(lidar_data):
-    coordinates = []
-    for angle in range(360):
-        distance = lidar_data[angle]
-        # 0 degrees is up (positive y-axis), adjusting angle accordingly
-        adjusted_angle_rad = math.radians(90 - angle)  # Shift 0 degrees to point upward
-        x = distance * math.cos(adjusted_angle_rad)
-        y = distance * math.sin(adjusted_angle_rad)
-        coordinates.append((x, y, distance))
-    return coordinates
+# 0 degrees is up (positive y-axis), adjusting angle accordingly
+ADJUSTED_ANGLES_RAD = np.radians(90 - np.arange(360))  # Shift 0 degrees to point upward
+COS_ANGLES = np.cos(ADJUSTED_ANGLES_RAD).astype(np.float32)
+SIN_ANGLES = np.sin(ADJUSTED_ANGLES_RAD).astype(np.float32)
+
+def lidar_to_2d_coordinates(lidar_data, out=None):
+    """
+    Returns a (360, 3) float32 array of (x, y, distance) for every degree,
+    written into out when given.
+    """
+    if out is None:
+        out = np.empty((360, 3), dtype=np.float32)
+
+    distances = lidar_data[:360]
+    np.multiply(distances, COS_ANGLES, out=out[:, 0])
+    np.multiply(distances, SIN_ANGLES, out=out[:, 1])
+    out[:, 2] = distances
+    return out
 
 def find_farthest_point(coordinates):
-    filtered_points = [point for point in coordinates if point[1] > 0]
-    if not filtered_points:
+    ahead = coordinates[:, 1] > 0
+    if not ahead.any():
         return None
-    farthest_point = max(filtered_points, key=lambda p: p[2])
-    return farthest_point
+    farthest_index = np.argmax(np.where(ahead, coordinates[:, 2], -np.inf))
+    return coordinates[farthest_index]
 
 def point_along_line(origin, target, distance):
     vector_x = target[0] - origin[0]
@@ -169,50 +216,18 @@ def point_along_line(origin, target, distance):
 
     return [point_x, point_y]
 
-def find_side_points(coordinates, origin):
-    lefts = []
-    rights = []
-    adding_to_lefts = True
-
-    for i in range(len(coordinates)):
-        last_point = coordinates[(i - 1) % len(coordinates)]
-        point = coordinates[i]
-
-        if point == origin or (last_point[1] < 0 and point[1] > 0):
-            adding_to_lefts = not adding_to_lefts
-            continue
-
-        # Skip segments where either coordinate has a negative y-value
-        if point[1] <= 0:
-            continue
+def find_walls(coordinates, origin):
+    walls = Walls(find_wall_segments(coordinates, origin))
 
-        # Add to lefts or rights based on the current state
-        if adding_to_lefts:
-            lefts.append(point)
-        else:
-            rights.append(point)
-    
-    if len(lefts) == 0 or len(rights) == 0:
+    if not walls.has_sides():
         print('WARN! No left or right side.')
-        # print(lefts)
-        # print(rights)
-        return lefts, rights
 
-    return lefts, rights
+    return walls
 
-def find_closest_points_on_sides(origin, midpoint, left_points, right_points):
+def find_closest_points_on_sides(origin, midpoint, walls):
+    # Only the parts of the walls not ahead of the current point count
     y_threshold = origin[1]
-
-    filtered_lefts = [point for point in left_points if not (point[1] > y_threshold)]
-    filtered_rights = [point for point in right_points if not (point[1] > y_threshold)]
-
-    closest_left = min(filtered_lefts, key=lambda p: math.hypot(p[0] - midpoint[0], p[1] - midpoint[1]), default=None)
-    closest_right = min(filtered_rights, key=lambda p: math.hypot(p[0] - midpoint[0], p[1] - midpoint[1]), default=None)
-
-    # closest_left = min(left_points, key=lambda p: math.hypot(p[0] - midpoint[0], p[1] - midpoint[1]), default=None)
-    # closest_right = min(right_points, key=lambda p: math.hypot(p[0] - midpoint[0], p[1] - midpoint[1]), default=None)
-
-    return closest_left, closest_right
+    return walls.closest_points(midpoint, y_threshold)
 
 def adjust_midpoint(midpoint, closest_left, closest_right, distance=CAR_WIDTH):
     # distance here is different to one in find_adjusted_path_with_points()
@@ -243,12 +258,10 @@ def adjust_midpoint(midpoint, closest_left, closest_right, distance=CAR_WIDTH):
     else:
         return [(closest_left[0] + closest_right[0]) / 2, (closest_left[1] + closest_right[1]) / 2]
 
-def find_adjusted_path_with_points(origin, target, coordinates, distance=UNIT_PATH_LENGTH):
+def find_adjusted_path_with_points(origin, target, walls, distance=UNIT_PATH_LENGTH):
     current_point = origin
     path_points = [current_point[:2]]  # Store all path points
 
-    lefts, rights = find_side_points(coordinates, origin)
-
     count = 1
     while True:
         if count % 20 == 0:
@@ -261,9 +274,9 @@ def find_adjusted_path_with_points(origin, target, coordinates, distance=UNIT_PA
             path_points.append(target)
             return path_points
         
-        closest_left, closest_right = find_closest_points_on_sides(current_point, next_point, lefts, rights)
+        closest_left, closest_right = find_closest_points_on_sides(current_point, next_point, walls)
         # print(closest_left, closest_right)
-        if not closest_left or not closest_right:
+        if closest_left is None or closest_right is None:
             adjusted_point = [0,0]
         else:
             adjusted_point = adjust_midpoint(next_point, closest_left, closest_right)
@@ -288,16 +301,19 @@ def convert_angle_to_ratio(angle):
     ratio = max(min(angle / max_angle, 1.0), -1.0)
     return ratio
 
-def plot_lines_to_farthest_point_in_func(lidar_data, coordinates, farthest_point, path_points):
+def plot_lines_to_farthest_point_in_func(lidar_data, coordinates, farthest_point, path_points, walls=None):
     plt.clf()  # Clear the previous figure
 
-    coordinates = np.array(coordinates)
     x_coords = coordinates[:, 0]
     y_coords = coordinates[:, 1]
 
     plt.scatter(x_coords, y_coords, s=10, c='blue', alpha=0.6, label='Lidar Points')
     plt.scatter(*farthest_point, c='red', s=50, label='Farthest Point (y > 0)')
 
+    if walls is not None:
+        for x0, y0, x1, y1, side in walls.segments:
+            plt.plot([x0, x1], [y0, y1], '-', color='orange' if side == LEFT else 'cyan', linewidth=2)
+
     path_points = np.array(path_points)
     path_x = path_points[:, 0]
     path_y = path_points[:, 1]
@@ -314,10 +330,14 @@ def plot_lines_to_farthest_point_in_func(lidar_data, coordinates, farthest_point
 
     plt.pause(0.001)
 
-def path_find(lidar_data):
-    coordinates = lidar_to_2d_coordinates(lidar_data)
+def path_find(lidar_data, buffers=None):
+    if buffers is None:
+        buffers = WorkBuffers()
+
+    coordinates = lidar_to_2d_coordinates(lidar_data, buffers.get("coordinates", (360, 3)))
     farthest_point = find_farthest_point(coordinates)
-    points = find_adjusted_path_with_points(farthest_point, [0, 0], coordinates)
+    walls = find_walls(coordinates, farthest_point)
+    points = find_adjusted_path_with_points(farthest_point, [0, 0], walls)
     # print('PATH: ', points)
 
     points_distance = PREDICT_LEVEL
@@ -332,55 +352,50 @@ def path_find(lidar_data):
     print(f"Ratio: {ratio}")
 
     if SHOW_PLOT:
-        plot_lines_to_farthest_point_in_func(lidar_data, coordinates, farthest_point[:-1], points)
+        plot_lines_to_farthest_point_in_func(lidar_data, coordinates, farthest_point[:-1], points, walls)
     return ratio, farthest_point
 
-def update_lidar():
+def update_lidar(scan, buffers=None, window_size=WINDOW_SIZE):
     """
     Receive the lidar samples and get the average samples from it
-    """
-    global average_scan
 
-    scan = racecar.get_lidar_data()
+    Returns None when the scan has no data yet. The returned array is one of
+    the work buffers and is overwritten by the next call.
+    """
     if (len(scan) == 0):
-        return False
+        return None
     
     if (scan[0] == 0.0):
-        return False
-    
-    scan = np.clip(scan, None, 1000)
+        return None
+
+    if buffers is None:
+        buffers = WorkBuffers()
+
+    scan = np.minimum(scan, 1000, out=buffers.get("scan", scan.shape))
     
     if not IS_SIM:
         scan_length = len(scan) # 1081, 1 for 0 angle maybe?
         values_per_angle = (scan_length - 1) / 270
         degree_0 = int((scan_length - 1) / 2)
-        first_half = scan[:degree_0] # 135 to 0
-        backward = np.full(int(90 * values_per_angle - 1), 30)
-        second_half = scan[degree_0:] # 0 to -135
-        rotated_scan = np.concatenate([second_half, backward, first_half])
+        backward_length = int(90 * values_per_angle - 1)
+        second_half_length = scan_length - degree_0
+
+        # second half (0 to -135), backward, first half (135 to 0)
+        rotated_scan = buffers.get("rotated_scan", (scan_length + backward_length,))
+        rotated_scan[:second_half_length] = scan[degree_0:]
+        rotated_scan[second_half_length:second_half_length + backward_length] = 30
+        rotated_scan[second_half_length + backward_length:] = scan[:degree_0]
     else:
         rotated_scan = scan
 
-    average_scan = np.array([get_lidar_average_distance(rotated_scan, angle, WINDOW_SIZE) for angle in range(360)])
-    print(average_scan)
-    return
+    average_scan = get_lidar_average_distances(rotated_scan, window_size, buffers.get("average_scan", (360,)), buffers)
+    # print(average_scan)
+    return average_scan
 
 def start():
     """
     This function is run once every time the start button is pressed
     """
-    global speed
-    global angle
-
-    # Initialize variables
-    speed = 0
-    angle = 0
-
-    # Set initial driving speed and angle
-    # rc.drive.set_speed_angle(speed, angle)
-    # Set update_slow to refresh every half second
-    #rc.set_update_slow_time(0.5)
-
     # Print start message
     print(
         ">> Wall Following\n"
@@ -389,95 +404,101 @@ def start():
         "    A button = print current speed, angle, and closest values\n"
     )
 
-def update():
-    global speed
-    global angle
-    global prev_error_angle
-    global prev_error_speed
-    global integral_angle
-    global integral_speed
-    global average_scan
-    global flag
-
-    if update_lidar() == False:
-        return
-    
-    start = time.time()
-    angle_error, farthest_point = path_find(average_scan)
-    print('time: ', time.time() - start)
-
-    # Update angle integral term
-    integral_angle += angle_error
-
-    # Update angle derivative term
-    angle_derivative = angle_error - prev_error_angle
-    prev_error_angle = angle_error
-
-    # Calculate angle PID output
-    angle_pid_output = KP * angle_error + KI * integral_angle + KD * angle_derivative
-
-    # Convert angle PID output to angle
-    angle = angle_pid_output
-
-    # # PID control for speed
-    # # Calculate speed error (difference between desired and actual speed)
-    # speed_error = desired_speed - speed
-
-    # # Update speed integral term
-    # integral_speed += speed_error
-
-    # # Update speed derivative term
-    # speed_derivative = speed_error - prev_error_speed
-    # prev_error_speed = speed_error
-
-    # # Calculate speed PID output
-    # speed_pid_output = KP_speed * speed_error + KI_speed * integral_speed + KD_speed * speed_derivative
-
-    # # Convert speed PID output to speed
-    # speed += speed_pid_output
-
-    speed = 0.2
-
-    farthest_distance = farthest_point[2]
-    if farthest_distance < 350 and flag < 30:
-        speed = 0.0
-        flag += 1
-    elif flag > 0:
-        flag += 1
-    else:
-        flag = 0
-    flag %= 60
-
-    # emergency_distance = get_farthest_distance_in_range(average_scan, -45, 45)
-    # if emergency_distance < 30:
-    #     speed = -1.0
+########################################################################################
+# Controller
+########################################################################################
 
-    # Constrain speed and angle within 0.0 to 1.0
-    # speed = max(0.0, min(1.0, speed))
-    angle = max(-1.0, min(1.0, angle))
+class PIDFollower(Controller):
+    """
+    Follows the adjusted path with a PID on the steering angle.
 
-    # Set the speed and angle of the car
-    racecar.set_speed_and_angle(speed, angle)
+    The state is kept as one array entry per agent, so a single PIDFollower
+    can drive num_agents cars: step() takes a (num_agents, samples) array of
+    scans and returns a (num_agents, 2) array of (speed, angle).
+    A single 1D scan returns a (speed, angle) tuple.
 
-    # Print the current speed and angle and closest values when the A button is held down
-    # if rc.controller.is_down(rc.controller.Button.A):
-    #     print("Speed:", speed, "Angle:", angle)
-        # print("Left:", closest_left_angle, ",", closest_left_distance)
-        # print("Right:", closest_right_angle, ",", closest_right_distance)
-        # print("Front:", closest_front_angle, ",", closest_front_distance)
+    With temporal_scans set, the scans first go through a TemporalLidarFilter
+    over that many scans, which allows a smaller window_size.
+    """
+    __slots__ = ("num_agents", "kp", "ki", "kd", "window_size", "lidar_filter",
+                 "prev_error_angle", "integral_angle", "flag", "action", "buffers")
+
+    def __init__(self, num_agents=1, kp=KP, ki=KI, kd=KD, window_size=WINDOW_SIZE, temporal_scans=TEMPORAL_SCANS):
+        self.num_agents = num_agents
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.window_size = window_size
+        self.lidar_filter = TemporalLidarFilter(temporal_scans) if temporal_scans else None
+        self.buffers = WorkBuffers()
+        self.reset()
+
+    def reset(self):
+        self.prev_error_angle = np.zeros(self.num_agents)  # Previous error for angle control
+        self.integral_angle = np.zeros(self.num_agents)  # Integral term for angle control
+        self.flag = np.zeros(self.num_agents, dtype=np.int64)
+        self.action = np.zeros((self.num_agents, 2), dtype=np.float32)  # (speed, angle)
+        if self.lidar_filter is not None:
+            self.lidar_filter.reset()
+
+    def step(self, obs):
+        scans = np.atleast_2d(obs)
+        assert len(scans) == self.num_agents, f"expected {self.num_agents} scans, got {len(scans)}"
+        if self.lidar_filter is not None and has_data(scans):
+            scans = self.lidar_filter.update(scans)
+
+        angle_error = self.buffers.get("angle_error", (self.num_agents,))
+        farthest_distance = self.buffers.get("farthest_distance", (self.num_agents,))
+        valid = self.buffers.get("valid", (self.num_agents,), bool)
+        valid.fill(False)
+        for i, scan in enumerate(scans):
+            average_scan = update_lidar(scan, self.buffers, self.window_size)
+            if average_scan is None:
+                continue
+
+            start = time.time()
+            angle_error[i], farthest_point = path_find(average_scan, self.buffers)
+            print('time: ', time.time() - start)
+            farthest_distance[i] = farthest_point[2]
+            valid[i] = True
+
+        # Agents without lidar data keep their previous action
+        if valid.any():
+            self._update(valid, angle_error[valid], farthest_distance[valid])
+
+        if np.ndim(obs) == 1:
+            return tuple(self.action[0])
+        return self.action
+
+    def _update(self, valid, angle_error, farthest_distance):
+        # Update angle integral term
+        self.integral_angle[valid] += angle_error
+
+        # Update angle derivative term
+        angle_derivative = angle_error - self.prev_error_angle[valid]
+        self.prev_error_angle[valid] = angle_error
+
+        # Calculate angle PID output
+        angle = self.kp * angle_error + self.ki * self.integral_angle[valid] + self.kd * angle_derivative
+
+        # Stop for a while when the farthest point gets close
+        flag = self.flag[valid]
+        stop = (farthest_distance < STOP_DISTANCE) & (flag < STOP_TICKS)
+        speed = np.where(stop, 0.0, 0.2)
+        self.flag[valid] = np.where(stop | (flag > 0), flag + 1, 0) % FLAG_PERIOD
+
+        # emergency_distance = get_farthest_distance_in_range(average_scan, -45, 45)
+        # if emergency_distance < 30:
+        #     speed = -1.0
+
+        # Constrain angle within -1.0 to 1.0
+        self.action[valid, 0] = speed
+        self.action[valid, 1] = np.clip(angle, -1.0, 1.0)
 
 ## Do not modify the code below
 ## Unless you want to change the update sleep time or the setup and close logic
 if __name__ == "__main__":
-    try:
-        racecar.start()
-
-        while True:
-            update()
-            # Sleep for a short duration to simulate real-time control
-            # racecar.set_speed_and_angle(speed, angle)
-            time.sleep(0.1)
-
-    except KeyboardInterrupt:
-        # Close the environment when the script is interrupted
-        racecar.close()
\ No newline at end of file
+    # attaches to the sim server if RACECAR_SIM_PORT is set
+    racecar = connect(env_path, time_scale=1.0)
+    start()
+    run_controller(racecar, PIDFollower(), period=0.1)
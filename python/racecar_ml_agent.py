@@ -1,90 +1,291 @@
 from mlagents_envs.environment import UnityEnvironment
 from mlagents_envs.side_channel.engine_configuration_channel import EngineConfigurationChannel
-from mlagents_envs.base_env import ActionTuple
+from frame_skip import POOL_LAST, POOL_MAX, POOL_STACK, POOLING_MODES, FrameRepeater  # pooling modes re-exported
+from sampling_profiler import SamplingProfiler
+from scheduler import RateScheduler
+from sim_server import DEFAULT_SIM_PORT, SimClient
+from work_buffers import WorkBuffers
 import numpy as np
 import threading
 import time
+import os
+
+# output file of the sampling profiler, enables it when set
+PROFILE_ENV = "RACECAR_PROFILE"
 
 class RacecarMLAgent:
-    def __init__(self, env_path, time_scale=1.0):
-        self.engine_configuration_channel = EngineConfigurationChannel()
-        self.env = UnityEnvironment(file_name=env_path, side_channels=[self.engine_configuration_channel])
-        self.engine_configuration_channel.set_configuration_parameters(time_scale=time_scale)
+    def __init__(self, env_path, time_scale=1.0, frame_skip=1, max_frame_skip=None, pooling=POOL_LAST,
+                 port=DEFAULT_SIM_PORT, step_period=0.01, profile=None, profile_interval=0.005):
+        """
+        Args:
+            env_path: Path to the Unity build, or None to attach to a running
+                sim server (see sim_server.py) on port. Attaching resets the episode.
+            time_scale: Unity time scale.
+            frame_skip: Number of env.step() calls each action is repeated for.
+                Each call is still one exchange with Unity when the build is
+                launched here; attached to a sim server, the repeats run on
+                the server and a decision costs one socket round trip.
+            max_frame_skip: When larger than frame_skip, the skip count adapts:
+                it doubles (up to max_frame_skip) while the commanded speed and
+                angle stay the same and drops back to frame_skip when they change.
+            pooling: How lidar scans over the skipped frames are combined, one of
+                "last", "max" or "stack". Lidar.get_samples() is always a single
+                scan (the most recent one with "stack"), the stacked scans are
+                read with Lidar.get_stack().
+            port: Port of the sim server, used when env_path is None.
+            step_period: Seconds between decisions of the stepping thread.
+            profile: File the sampling profiler writes the stepping and controller
+                thread stacks to on close(), speedscope for a .json path and
+                collapsed stacks otherwise. Defaults to the RACECAR_PROFILE
+                environment variable, no profiling when neither is set.
+            profile_interval: Seconds between profiler samples.
+        """
+        assert frame_skip >= 1, f"frame_skip ({frame_skip}) must be at least 1"
+        assert pooling in POOLING_MODES, f"pooling ({pooling}) must be one of {POOLING_MODES}"
+
+        if env_path is None:
+            self.env = SimClient(port)
+            self.env.set_time_scale(time_scale)
+        else:
+            self.engine_configuration_channel = EngineConfigurationChannel()
+            self.env = UnityEnvironment(file_name=env_path, side_channels=[self.engine_configuration_channel])
+            self.engine_configuration_channel.set_configuration_parameters(time_scale=time_scale)
         self.env.reset()
         self.behavior_name = list(self.env.behavior_specs.keys())[0]
-        
+
+        # frame skip
+        self.frame_skip = frame_skip
+        self.max_frame_skip = max(frame_skip, max_frame_skip or frame_skip)
+        self.pooling = pooling
+        self.current_frame_skip = frame_skip
+        self._last_action = None
+
         # observations
         self.physics = Physics()
         self.lidar = Lidar()
-        
+
+        # work buffers reused every step
+        self.buffers = WorkBuffers()
+        self._action = self.buffers.get("action", (1, 2))  # (angle, speed)
+        self.repeater = FrameRepeater(self.behavior_name, pooling, self.max_frame_skip)
+
         # actions
         self.speed = 0.0
         self.angle = 0.0
-        self.running = False
+        self.actions = None  # (num_agents, 2) per-agent (speed, angle), see set_actions()
+
+        # the stepping thread sends speed 0 while the last command is older
+        # than command_timeout seconds, None to keep driving with it
+        self.command_timeout = None
+        self._command_time = time.monotonic()
+        self.braked_steps = 0
         self.thread = None
+        self.scheduler = RateScheduler(step_period)
+
+        # profiling
+        self.profile = profile or os.environ.get(PROFILE_ENV)
+        self.profiler = SamplingProfiler(profile_interval) if self.profile else None
+
+    def _next_frame_skip(self, action):
+        """
+        Returns the number of frames to repeat action for.
+        """
+        if self.max_frame_skip == self.frame_skip:
+            return self.frame_skip
+
+        if action == self._last_action:
+            self.current_frame_skip = min(self.current_frame_skip * 2, self.max_frame_skip)
+        else:
+            self.current_frame_skip = self.frame_skip
+        self._last_action = action
+        return self.current_frame_skip
+
+    def _step_repeated(self, frames):
+        """
+        Repeats the current action for the given number of env.step() calls,
+        on the sim server when attached to one.
+        """
+        if isinstance(self.env, SimClient):
+            return self.env.step_repeated(self.behavior_name, self._action, frames, self.pooling, self.max_frame_skip)
+        return self.repeater.step(self.env, self._action, frames)
+
+    def _step(self):
+        # Custom action for speed and angle, read once so the frame skip
+        # decision describes the command that is sent
+        actions = self.actions
+        if actions is None:
+            action = (self.angle, self.speed)
+            self._action = self.buffers.get("action", (1, 2))
+            self._action[0] = action
+        else:
+            self._action = self.buffers.get("action", actions.shape)
+            self._action[:, 0] = actions[:, 1]
+            self._action[:, 1] = actions[:, 0]
+            action = actions.tobytes()
+
+        # The controller is late with its next command, brake at the deadline
+        timeout = self.command_timeout
+        if timeout is not None and time.monotonic() - self._command_time > timeout:
+            self._action[:, 1] = 0.0
+            self.braked_steps += 1
+            action = (action, "brake")
+        frames = self._next_frame_skip(action)
+        agent_ids, physics, lidar = self._step_repeated(frames)
+        if len(agent_ids) == 0:
+            return
+
+        # Read data from observations and updating them, the first agent's physics
+        self.physics.update(physics[0, :3].copy(), physics[0, 3:6].copy())
+        if self.pooling == POOL_STACK:
+            self.lidar.update(lidar[:, frames - 1], agent_ids, lidar[0], frames)
+        else:
+            self.lidar.update(lidar[:, 0], agent_ids)
 
     def _run(self):
-        while self.running:
-            decision_steps, terminal_steps = self.env.get_steps(self.behavior_name)
-
-            # extract the data from the environment and set the action
-            for agent_id in decision_steps:
-                # Read data from observations and updating them
-                linear_acceleration = decision_steps[agent_id].obs[0][:3]
-                angular_velocity = decision_steps[agent_id].obs[0][3:6]
-                self.physics.update(linear_acceleration, angular_velocity)
-                self.lidar.update(decision_steps[agent_id].obs[0][6:])
-                # print(f"observation len = {len(decision_steps[agent_id].obs[0])}.")
-
-                # Custom action for speed and angle
-                action = [self.angle, self.speed]
-                action_tuple = ActionTuple(continuous=np.array([action], dtype=np.float32))
-                self.env.set_action_for_agent(self.behavior_name, agent_id, action_tuple)
-                
-            # Step the environment
-            self.env.step()
-            time.sleep(0.01)  # update at 100 Hz
-
-    def start(self):
-        self.running = True
-        self.thread = threading.Thread(target=self._run)
+        # update at 100 Hz by default
+        self.scheduler.run(self._step)
+
+    def start(self, controller_name="controller"):
+        """
+        Starts the stepping thread. With profiling on, the stepping thread and
+        the calling (controller) thread are sampled, the latter under controller_name.
+        """
+        self.scheduler.arm()
+        self.thread = threading.Thread(target=self._run, name="stepping")
         self.thread.start()
 
+        if self.profiler is not None:
+            self.profiler.watch(self.thread)
+            self.profiler.watch(threading.current_thread(), controller_name)
+            self.profiler.start()
+
     def stop(self):
-        self.running = False
+        self.scheduler.stop()
         if self.thread is not None:
             self.thread.join()
+            self.thread = None
+            print(f"Stepping thread: {self.scheduler.summary()}, {self.braked_steps} steps braked for late commands")
 
     def close(self):
         self.stop()
+        if self.profiler is not None:
+            self.profiler.stop()
+            self.profiler.write(self.profile)
         self.env.close()
 
     def set_speed_and_angle(self, speed, angle):
+        """
+        Sends the same speed and angle to every agent.
+        """
         self.speed = speed
         self.angle = angle
-        
+        self.actions = None
+        self._command_time = time.monotonic()
+
+    def set_actions(self, actions):
+        """
+        Sends one (speed, angle) row of the (num_agents, 2) actions to each
+        agent, in the order of Lidar.get_scans().
+        """
+        self.actions = np.array(actions, dtype=np.float32)
+        self._command_time = time.monotonic()
+
+    def brake(self):
+        """
+        Stops the cars, keeping the current steering angles.
+        """
+        self.speed = 0.0
+        actions = self.actions
+        if actions is not None:
+            actions = actions.copy()
+            actions[:, 0] = 0.0
+            self.actions = actions
+
+def connect(env_path, **kwargs):
+    """
+    Creates a RacecarMLAgent, attaching to the sim server on RACECAR_SIM_PORT
+    when that environment variable is set and launching env_path otherwise.
+    """
+    port = os.environ.get("RACECAR_SIM_PORT")
+    if port:
+        return RacecarMLAgent(None, port=int(port), **kwargs)
+    return RacecarMLAgent(env_path, **kwargs)
+
 # wrapper class for Lidar data
 class Lidar:
     def __init__(self) -> None:
-        self.data = []
-        
-    def update(self, data):
-        self.data = data
-    
-    def get_samples(self):
-        return self.data
-    
+        self.scans = np.zeros((0, 0), dtype=np.float32)
+        self.agent_ids = np.zeros(0, dtype=np.int32)
+        self.stack = np.zeros((0, 0), dtype=np.float32)
+        self.frames = 0
+        self.lock = threading.Lock()
+
+    def update(self, scans, agent_ids, stack=None, frames=0):
+        """
+        Stores the latest (num_agents, samples) scans with their agent ids and,
+        with "stack" pooling, the first agent's fixed-size (max_frame_skip,
+        samples) stack whose first frames rows are valid.
+        """
+        with self.lock:
+            self.scans = _copy_into(self.scans, scans)
+            self.agent_ids = _copy_into(self.agent_ids, agent_ids)
+            if stack is not None:
+                self.stack = _copy_into(self.stack, stack)
+                self.frames = frames
+
+    def get_samples(self, out=None):
+        """
+        Returns a copy of the first agent's latest lidar scan, a (samples,) array.
+
+        Pass the previously returned array as out to reuse it instead of
+        allocating a new one every tick.
+        """
+        with self.lock:
+            if len(self.scans) == 0:
+                return np.zeros(0, dtype=np.float32)
+            return _copy_out(self.scans[0], out)
+
+    def get_scans(self, out=None):
+        """
+        Returns (scans, agent_ids): a copy of the latest (num_agents, samples)
+        scans of every agent and their ids, for controllers that batch over agents.
+        """
+        with self.lock:
+            return _copy_out(self.scans, out), self.agent_ids.copy()
+
+    def get_stack(self, out=None):
+        """
+        Returns (stack, frames): a copy of the (max_frame_skip, samples) scans
+        seen during the last decision with "stack" pooling, oldest frame first,
+        of which the first frames rows are valid. The shape does not change
+        with the frame skip, so out can be reused every tick.
+        """
+        with self.lock:
+            return _copy_out(self.stack, out), self.frames
+
+def _copy_into(buffer, data):
+    if buffer.shape != data.shape:
+        buffer = np.empty(data.shape, dtype=buffer.dtype)
+    np.copyto(buffer, data)
+    return buffer
+
+def _copy_out(data, out):
+    if out is None or out.shape != data.shape:
+        return data.copy()
+    np.copyto(out, data)
+    return out
+
 class Physics:
     def __init__(self) -> None:
         self.linear_acceleration = []
         self.angular_velocity = []
-        
+
     def update(self, linear_acceleration, angular_velocity):
         self.linear_acceleration = linear_acceleration
         self.angular_velocity = angular_velocity
-        
+
     def get_linear_acceleration(self):
         return self.linear_acceleration
-    
+
     def get_angular_velocity(self):
         return self.angular_velocity
\ No newline at end of file
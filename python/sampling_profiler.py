@@ -0,0 +1,122 @@
+from scheduler import RateScheduler
+import json
+import os
+import sys
+import threading
+
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+
+class SamplingProfiler:
+    """
+    Low-overhead sampling profiler for the threads of a run.
+
+    A background thread reads the stacks of the watched threads with
+    sys._current_frames() every interval seconds and counts each distinct
+    stack in memory. Nothing is traced in between samples, so the watched
+    threads run at full speed apart from the GIL the sampler briefly holds.
+
+    write() saves the counts as collapsed stacks ("thread;outer;inner count"
+    lines, for flamegraph.pl and similar tools) or, for a .json path, as a
+    speedscope file with one profile per thread.
+    """
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.threads = {}  # thread ident -> label
+        self.stacks = {}   # (label, frame indices root first) -> samples
+        self.frames = []   # (name, file, line) of every frame index
+        self._frame_indices = {}  # code object -> frame index
+        self.scheduler = RateScheduler(interval)
+        self.thread = None
+
+    def watch(self, thread, label=None):
+        """
+        Samples thread from now on, its stacks are rooted at label (the thread name by default).
+        """
+        self.threads[thread.ident] = label or thread.name
+
+    def start(self):
+        self.scheduler.arm()
+        self.thread = threading.Thread(target=self.scheduler.run, args=(self.sample,), daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.scheduler.stop()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _frame_index(self, code):
+        index = self._frame_indices.get(code)
+        if index is None:
+            index = len(self.frames)
+            self.frames.append((code.co_name, code.co_filename, code.co_firstlineno))
+            self._frame_indices[code] = index
+        return index
+
+    def sample(self):
+        """
+        Records the current stack of every watched thread.
+        """
+        current_frames = sys._current_frames()
+        for ident, label in self.threads.items():
+            frame = current_frames.get(ident)
+            if frame is None:
+                continue
+
+            stack = []
+            while frame is not None:
+                stack.append(self._frame_index(frame.f_code))
+                frame = frame.f_back
+            stack.reverse()
+
+            key = (label, tuple(stack))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def samples(self):
+        return sum(self.stacks.values())
+
+    def _frame_name(self, index):
+        name, file, line = self.frames[index]
+        return f"{name} ({os.path.basename(file)}:{line})"
+
+    def write_collapsed(self, path):
+        with open(path, "w") as f:
+            for (label, stack), count in sorted(self.stacks.items()):
+                names = [label] + [self._frame_name(index) for index in stack]
+                f.write(f"{';'.join(names)} {count}\n")
+
+    def write_speedscope(self, path):
+        profiles = {}
+        for (label, stack), count in self.stacks.items():
+            profile = profiles.setdefault(label, {
+                "type": "sampled",
+                "name": label,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": 0,
+                "samples": [],
+                "weights": [],
+            })
+            weight = count * self.interval * 1000
+            profile["samples"].append(list(stack))
+            profile["weights"].append(weight)
+            profile["endValue"] += weight
+
+        with open(path, "w") as f:
+            json.dump({
+                "$schema": SPEEDSCOPE_SCHEMA,
+                "shared": {"frames": [{"name": name, "file": file, "line": line} for name, file, line in self.frames]},
+                "profiles": list(profiles.values()),
+                "name": os.path.basename(path),
+                "exporter": "sampling_profiler.py",
+            }, f)
+
+    def write(self, path):
+        """
+        Writes a speedscope file when path ends in .json and collapsed stacks otherwise.
+        """
+        if path.endswith(".json"):
+            self.write_speedscope(path)
+        else:
+            self.write_collapsed(path)
+        print(f"Profiler: wrote {self.samples()} samples to {path}")
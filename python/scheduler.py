@@ -0,0 +1,64 @@
+import time
+
+class RateScheduler:
+    """
+    Runs a callback at a fixed rate against absolute time.monotonic() deadlines.
+
+    The time the callback takes is subtracted from the sleep, so the period
+    does not drift as the callback gets slower. When a tick runs past its
+    deadline, the missed deadlines are counted and the next tick starts right
+    away on the original cadence instead of bursting to catch up. Reacting to
+    an overrun while it happens is up to the consumer of the callback's
+    output (see RacecarMLAgent.command_timeout), since the late callback has
+    not returned yet.
+
+    A new scheduler is armed: run() loops until stop() is called. stop() may
+    land before run() has started (e.g. on another thread), run() then
+    returns right away. Call arm() to run again after a stop().
+    """
+    def __init__(self, period):
+        self.period = period
+        self.running = True
+
+        # deadline accounting
+        self.ticks = 0
+        self.misses = 0
+        self.worst_lateness = 0.0
+
+    def run(self, callback):
+        """
+        Calls callback every period until stop() is called.
+        """
+        deadline = time.monotonic()
+
+        while self.running:
+            callback()
+            self.ticks += 1
+
+            next_deadline = deadline + self.period
+            now = time.monotonic()
+            if now < next_deadline:
+                time.sleep(next_deadline - now)
+                deadline = next_deadline
+                continue
+
+            # Overran, skip the deadlines that already passed
+            lateness = now - next_deadline
+            skipped = int(lateness // self.period)
+            self.misses += skipped + 1
+            self.worst_lateness = max(self.worst_lateness, lateness)
+            deadline = next_deadline + skipped * self.period
+
+    def arm(self):
+        """
+        Lets the next run() loop again after a stop(). Call it before starting
+        the thread that runs the scheduler, not from that thread.
+        """
+        self.running = True
+
+    def stop(self):
+        self.running = False
+
+    def summary(self):
+        return (f"{self.misses} missed deadlines in {self.ticks} ticks at {1 / self.period:.0f} Hz, "
+                f"worst {self.worst_lateness * 1000:.1f} ms late")
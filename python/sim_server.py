@@ -0,0 +1,263 @@
+"""
+Long-lived simulator server.
+
+The server launches the Unity build once and keeps it running. Controller
+scripts attach to it through a local socket instead of launching their own
+player, so repeated runs skip the Unity startup and handshake.
+
+Usage:
+    python sim_server.py start [--env PATH] [--port PORT]   # launch in the background
+    python sim_server.py serve [--env PATH] [--port PORT]   # run in the foreground
+    python sim_server.py status | reset | stop [--port PORT]
+
+Then run a controller with RACECAR_SIM_PORT set (or pass env_path=None to
+RacecarMLAgent) to attach to it.
+
+Every connection is served on its own thread, so status, reset and stop
+answer while a controller is attached. Clients authenticate with a random
+per-user key in ~/.racecar_sim_key (mode 0600) before anything is unpickled.
+"""
+from mlagents_envs.environment import UnityEnvironment
+from mlagents_envs.side_channel.engine_configuration_channel import EngineConfigurationChannel
+from frame_skip import FrameRepeater
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+import argparse
+import os
+import stat
+import subprocess
+import sys
+import threading
+import time
+
+DEFAULT_SIM_PORT = 5200
+AUTHKEY_PATH = os.path.join(os.path.expanduser("~"), ".racecar_sim_key")
+
+# UnityEnvironment methods a client is allowed to call
+ENV_METHODS = ("reset", "step", "get_steps", "set_action_for_agent", "set_actions")
+
+def authkey(path=AUTHKEY_PATH):
+    """
+    Returns the per-user key clients and server authenticate with, creating
+    it with 0600 permissions the first time.
+    """
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        pass
+    else:
+        with os.fdopen(fd, "wb") as f:
+            f.write(os.urandom(32))
+
+    mode = os.stat(path).st_mode
+    if mode & (stat.S_IRWXG | stat.S_IRWXO):
+        raise PermissionError(f"{path} must only be accessible by its owner (chmod 600 {path})")
+    with open(path, "rb") as f:
+        return f.read()
+
+class SimServer:
+    def __init__(self, env_path, port=DEFAULT_SIM_PORT, time_scale=1.0):
+        self.port = port
+        self.authkey = authkey()
+        self.engine_configuration_channel = EngineConfigurationChannel()
+        self.env = UnityEnvironment(file_name=env_path, side_channels=[self.engine_configuration_channel])
+        self.engine_configuration_channel.set_configuration_parameters(time_scale=time_scale)
+        self.env.reset()
+        self.env_lock = threading.Lock()  # clients are served on their own threads
+        self.repeaters = {}  # (behavior name, pooling, max frames) -> FrameRepeater
+        self.running = False
+
+    def _handle(self, method, args):
+        if method == "ping":
+            return "ok"
+        if method == "shutdown":
+            self.shutdown()
+            return None
+        with self.env_lock:
+            if method in ENV_METHODS:
+                return getattr(self.env, method)(*args)
+            if method == "step_repeated":
+                return self._step_repeated(*args)
+            if method == "behavior_specs":
+                return dict(self.env.behavior_specs)
+            if method == "set_time_scale":
+                self.engine_configuration_channel.set_configuration_parameters(time_scale=args[0])
+                return None
+        raise ValueError(f"Unknown sim server method: {method}")
+
+    def _step_repeated(self, behavior_name, actions, frames, pooling, max_frames):
+        key = (behavior_name, pooling, max_frames)
+        repeater = self.repeaters.get(key)
+        if repeater is None:
+            repeater = self.repeaters[key] = FrameRepeater(behavior_name, pooling, max_frames)
+        return repeater.step(self.env, actions, frames)
+
+    def shutdown(self):
+        """
+        Stops serve_forever(), waking it up from accept() with a connection of its own.
+        """
+        if self.running:
+            self.running = False
+            Client(("localhost", self.port), authkey=self.authkey).close()
+
+    def _serve_client(self, conn):
+        """
+        Serves requests from one attached client until it detaches.
+        """
+        while self.running:
+            try:
+                method, args = conn.recv()
+            except (EOFError, OSError):
+                return  # the client went away without detaching
+
+            if method == "detach":
+                return
+
+            try:
+                result = (True, self._handle(method, args))
+            except Exception as e:
+                result = (False, e)
+            try:
+                conn.send(result)
+            except OSError:
+                return
+
+    def _serve_thread(self, conn):
+        try:
+            self._serve_client(conn)
+        finally:
+            conn.close()
+
+    def serve_forever(self):
+        self.running = True
+        print(f"Sim server listening on localhost:{self.port}")
+        try:
+            with Listener(("localhost", self.port), authkey=self.authkey) as listener:
+                while self.running:
+                    try:
+                        conn = listener.accept()
+                    except (AuthenticationError, EOFError, OSError):
+                        continue  # failed handshake, e.g. a wrong key
+                    threading.Thread(target=self._serve_thread, args=(conn,), daemon=True).start()
+        finally:
+            self.running = False
+            with self.env_lock:
+                self.env.close()
+
+class SimClient:
+    """
+    Stands in for UnityEnvironment while attached to a SimServer.
+    """
+    def __init__(self, port=DEFAULT_SIM_PORT):
+        self.conn = Client(("localhost", port), authkey=authkey())
+
+    def _call(self, method, *args):
+        self.conn.send((method, args))
+        ok, result = self.conn.recv()
+        if not ok:
+            raise result
+        return result
+
+    @property
+    def behavior_specs(self):
+        return self._call("behavior_specs")
+
+    def reset(self):
+        self._call("reset")
+
+    def step(self):
+        self._call("step")
+
+    def get_steps(self, behavior_name):
+        return self._call("get_steps", behavior_name)
+
+    def set_action_for_agent(self, behavior_name, agent_id, action):
+        self._call("set_action_for_agent", behavior_name, agent_id, action)
+
+    def set_actions(self, behavior_name, action):
+        self._call("set_actions", behavior_name, action)
+
+    def step_repeated(self, behavior_name, actions, frames, pooling, max_frames):
+        """
+        Runs FrameRepeater.step on the server, so k frames cost one round trip.
+        """
+        return self._call("step_repeated", behavior_name, actions, frames, pooling, max_frames)
+
+    def set_time_scale(self, time_scale):
+        self._call("set_time_scale", time_scale)
+
+    def ping(self):
+        return self._call("ping")
+
+    def shutdown(self):
+        self._call("shutdown")
+        self.close()
+
+    def close(self):
+        """
+        Detaches from the server, leaving the simulation running.
+        """
+        if self.conn is not None:
+            try:
+                self.conn.send(("detach", ()))
+            except OSError:
+                pass  # the server already hung up
+            self.conn.close()
+            self.conn = None
+
+def _wait_until_up(port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            SimClient(port).close()
+            return True
+        except OSError:
+            time.sleep(0.5)
+    return False
+
+def main(argv=None):
+    default_env = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + "/Builds/sim"
+
+    parser = argparse.ArgumentParser(description="Persistent racecar simulator server.")
+    parser.add_argument("command", choices=("serve", "start", "stop", "status", "reset"))
+    parser.add_argument("--env", default=default_env, help="path to the Unity build")
+    parser.add_argument("--port", type=int, default=DEFAULT_SIM_PORT)
+    parser.add_argument("--time-scale", type=float, default=1.0)
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds to wait for start")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        SimServer(args.env, args.port, args.time_scale).serve_forever()
+        return 0
+
+    if args.command == "start":
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "serve",
+             "--env", args.env, "--port", str(args.port), "--time-scale", str(args.time_scale)],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        if not _wait_until_up(args.port, args.timeout):
+            print(f"Sim server did not come up on port {args.port}")
+            return 1
+        print(f"Sim server running on port {args.port}")
+        return 0
+
+    try:
+        client = SimClient(args.port)
+    except OSError:
+        print(f"No sim server on port {args.port}")
+        return 1
+
+    if args.command == "status":
+        print(f"Sim server on port {args.port}: {client.ping()}")
+        client.close()
+    elif args.command == "reset":
+        client.reset()
+        client.close()
+    elif args.command == "stop":
+        client.shutdown()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,20 @@
+import numpy as np
+
+def corridor_scan(rng, max_range=140, noise_factor=0.02):
+    """
+    Synthetic 360 sample lidar scan between two straight walls at random
+    distances and a random heading, with noise_factor relative range noise.
+
+    Distances are in Gaussian map cells (the map is 300 cells across with the
+    car in the middle, so every sample lands on it); scale them up for code
+    that works in cm.
+    """
+    angles = np.linspace(0, 2 * np.pi, 360)
+    yaw = rng.uniform(0, np.pi)
+    distances = np.full(360, float(max_range))
+    for normal, wall_distance in ((yaw, rng.uniform(5, 60)), (yaw + np.pi, rng.uniform(5, 60))):
+        facing = np.cos(angles - normal)
+        hit = facing > 1e-3
+        distances[hit] = np.minimum(distances[hit], wall_distance / facing[hit])
+    distances *= 1 + noise_factor * rng.standard_normal(360)
+    return distances.astype(np.float32)
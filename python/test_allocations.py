@@ -0,0 +1,32 @@
+"""
+Checks that the controllers stay within their per-tick allocation budget
+once their work buffers are warm. Run with `python -m pytest` from python/.
+"""
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("mlagents_envs")
+pytest.importorskip("matplotlib")
+
+from synthetic_scans import corridor_scan
+from work_buffers import allocations_per_tick
+
+BUDGET = 64 * 1024  # bytes allocated during one step() at most
+CM_PER_CELL = 10  # PIDFollower works in cm, the Gaussian map in cells
+
+@pytest.mark.parametrize("coarse_level", [None, 1])
+def test_gaussian_planner_allocations(coarse_level):
+    from gaussianForNewSim import GaussianPlanner
+
+    planner = GaussianPlanner(show_plot=False, coarse_level=coarse_level)
+    scan = corridor_scan(np.random.default_rng(0))
+    assert allocations_per_tick(lambda: planner.step(scan)) < BUDGET
+    # the scan landed on the map, so the template splat was measured too
+    assert planner.gaussian_maps[0].gaussian_map.max() > 0
+
+def test_pid_follower_allocations():
+    from map_with_pid_for_new_sim import PIDFollower
+
+    follower = PIDFollower()
+    scan = corridor_scan(np.random.default_rng(0)) * CM_PER_CELL
+    assert allocations_per_tick(lambda: follower.step(scan)) < BUDGET
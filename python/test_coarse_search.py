@@ -0,0 +1,32 @@
+"""
+Checks that the coarse-to-fine direction search lands close to the
+exhaustive search. Run with `python -m pytest` from python/.
+"""
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("mlagents_envs")
+pytest.importorskip("matplotlib")
+
+from gaussianForNewSim import GaussianMap, PathPlanner
+from synthetic_scans import corridor_scan
+
+# (radius, headings searched, degrees between the coarse and the exhaustive
+#  heading at most, fraction of maps where both pick the same heading at least)
+TOLERANCES = [(8, 360, 15.0, 0.95), (40, 360, 15.0, 0.95), (100, 360, 15.0, 0.95),
+              (40, 1440, 15.0, 0.9), (100, 1440, 15.0, 0.9)]
+
+@pytest.mark.parametrize("radius, num_headings, max_error, min_exact", TOLERANCES)
+def test_coarse_search_matches_exhaustive(radius, num_headings, max_error, min_exact):
+    rng = np.random.default_rng(radius)
+    gaussian_map = GaussianMap(sigma=4.5, decay_rate=0.98)
+    planner = PathPlanner(gaussian_map, gaussian_map.x_center, gaussian_map.y_center, num_headings)
+
+    errors = []
+    for _ in range(60):
+        gaussian_map.update_gaussian_map(corridor_scan(rng))
+        errors.append(planner.coarse_search_error(radius, coarse_level=1))
+
+    errors = np.array(errors)
+    assert errors.max() <= max_error
+    assert np.mean(errors == 0) >= min_exact
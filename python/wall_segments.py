@@ -0,0 +1,144 @@
+import numpy as np
+
+# side column values of a segment
+LEFT = 0
+RIGHT = 1
+
+JUMP_DISTANCE = 30  # Distance between neighbouring points that starts a new wall (cm)
+MAX_SEGMENT_POINTS = 30  # Longer walls are split into a polyline of segments this long
+
+def find_side_mask(coordinates, origin):
+    """
+    Splits the lidar points in front of the car into left and right walls.
+
+    Returns (keep, is_left) masks over coordinates. The side switches at the
+    origin and wherever the scan crosses back in front of the car; those points
+    and the ones behind the car (y <= 0) are not kept.
+    """
+    y = coordinates[:, 1]
+    toggles = np.all(coordinates == origin, axis=1) | ((np.roll(y, 1) < 0) & (y > 0))
+    is_left = np.cumsum(toggles) % 2 == 0
+    keep = ~toggles & (y > 0)
+    return keep, is_left
+
+def find_wall_segments(coordinates, origin, jump_distance=JUMP_DISTANCE, max_points=MAX_SEGMENT_POINTS):
+    """
+    Fits the walls on both sides of the car with line segments.
+
+    A wall ends where the side switches, where points were skipped, or where
+    two neighbouring points are more than jump_distance apart. Every wall is
+    split into chunks of at most max_points points and each chunk is fitted
+    with a total least squares line, all chunks at once.
+
+    Returns a (segments, 5) float32 array of (x0, y0, x1, y1, side).
+    """
+    keep, is_left = find_side_mask(coordinates, origin)
+    indices = np.flatnonzero(keep)
+    if len(indices) == 0:
+        return np.empty((0, 5), dtype=np.float32)
+
+    x = coordinates[indices, 0].astype(np.float64)
+    y = coordinates[indices, 1].astype(np.float64)
+    side = np.where(is_left[indices], LEFT, RIGHT)
+
+    # Wall boundaries
+    breaks = (np.diff(indices) > 1) | (np.diff(side) != 0) | (np.hypot(np.diff(x), np.diff(y)) > jump_distance)
+    wall_starts = np.concatenate(([0], np.flatnonzero(breaks) + 1))
+    wall_lengths = np.diff(np.append(wall_starts, len(indices)))
+
+    # Chunk every wall into pieces of at most max_points
+    position_in_wall = np.arange(len(indices)) - np.repeat(wall_starts, wall_lengths)
+    starts = np.flatnonzero(position_in_wall % max_points == 0)
+    ends = np.append(starts[1:], len(indices)) - 1
+    counts = ends - starts + 1
+
+    # Batched least squares: the line through the centroid along the principal axis
+    mean_x = np.add.reduceat(x, starts) / counts
+    mean_y = np.add.reduceat(y, starts) / counts
+    var_x = np.add.reduceat(x * x, starts) / counts - mean_x ** 2
+    var_y = np.add.reduceat(y * y, starts) / counts - mean_y ** 2
+    cov_xy = np.add.reduceat(x * y, starts) / counts - mean_x * mean_y
+    theta = 0.5 * np.arctan2(2 * cov_xy, var_x - var_y)
+    direction_x = np.cos(theta)
+    direction_y = np.sin(theta)
+
+    # End points are the first and last point of the chunk projected onto the line
+    t_start = (x[starts] - mean_x) * direction_x + (y[starts] - mean_y) * direction_y
+    t_end = (x[ends] - mean_x) * direction_x + (y[ends] - mean_y) * direction_y
+
+    segments = np.empty((len(starts), 5), dtype=np.float32)
+    segments[:, 0] = mean_x + t_start * direction_x
+    segments[:, 1] = mean_y + t_start * direction_y
+    segments[:, 2] = mean_x + t_end * direction_x
+    segments[:, 3] = mean_y + t_end * direction_y
+    segments[:, 4] = side[starts]
+    return segments
+
+class Walls:
+    """
+    Wall segments with the per-segment terms of the closest point query
+    computed once, so each query is a handful of array operations over the
+    segments.
+    """
+    __slots__ = ("segments", "start_x", "start_y", "delta_x", "delta_y", "inverse_dy", "inverse_length_sq",
+                 "rising", "falling", "flat", "is_left", "is_right")
+
+    def __init__(self, segments):
+        self.segments = segments
+        segments = segments.astype(np.float64)
+        self.start_x = segments[:, 0].copy()
+        self.start_y = segments[:, 1].copy()
+        self.delta_x = segments[:, 2] - segments[:, 0]
+        self.delta_y = segments[:, 3] - segments[:, 1]
+
+        self.rising = self.delta_y > 0
+        self.falling = self.delta_y < 0
+        self.flat = ~(self.rising | self.falling)
+        self.inverse_dy = np.divide(1.0, self.delta_y, out=np.zeros_like(self.delta_y), where=~self.flat)
+
+        length_sq = self.delta_x ** 2 + self.delta_y ** 2
+        self.inverse_length_sq = np.divide(1.0, length_sq, out=np.zeros_like(length_sq), where=length_sq > 0)
+
+        self.is_left = segments[:, 4] == LEFT
+        self.is_right = segments[:, 4] == RIGHT
+
+    def __len__(self):
+        return len(self.segments)
+
+    def has_sides(self):
+        return self.is_left.any() and self.is_right.any()
+
+    def closest_points(self, point, y_max):
+        """
+        Finds the closest point to point on the left and on the right walls,
+        only considering the parts of the segments with y <= y_max.
+
+        Returns (closest_left, closest_right), either is None when that side
+        has no segment below y_max.
+        """
+        px, py = point[0], point[1]
+
+        # Range [low, high] of the segment parameter t in [0, 1] where y <= y_max
+        t_cross = (y_max - self.start_y) * self.inverse_dy
+        low = np.maximum(t_cross, 0.0) * self.falling
+        high = 1.0 - (1.0 - np.minimum(t_cross, 1.0)) * self.rising
+        valid = (low <= high) & ~(self.flat & (self.start_y > y_max))
+
+        # Project point onto every segment and clamp to that range
+        t = ((px - self.start_x) * self.delta_x + (py - self.start_y) * self.delta_y) * self.inverse_length_sq
+        t = np.minimum(np.maximum(t, low), high)
+        closest_x = self.start_x + t * self.delta_x
+        closest_y = self.start_y + t * self.delta_y
+        distance_sq = (closest_x - px) ** 2 + (closest_y - py) ** 2
+        distance_sq[~valid] = np.inf
+
+        def closest_on_side(on_side):
+            side_distance_sq = np.where(on_side, distance_sq, np.inf)
+            if len(side_distance_sq) == 0:
+                return None
+            index = np.argmin(side_distance_sq)
+            if side_distance_sq[index] == np.inf:
+                return None
+            return [closest_x[index], closest_y[index]]
+
+        return closest_on_side(self.is_left), closest_on_side(self.is_right)
@@ -0,0 +1,62 @@
+import numpy as np
+import tracemalloc
+
+class WorkBuffers:
+    """
+    Arena of named work arrays that are allocated once and reused every tick.
+
+    Hot loops ask for their temporaries by name and write into them with out=
+    instead of allocating new arrays each frame. An array is only reallocated
+    when the requested shape or dtype changes.
+    """
+    def __init__(self, dtype=np.float32):
+        self.dtype = dtype
+        self.buffers = {}
+
+    def get(self, name, shape, dtype=None):
+        dtype = self.dtype if dtype is None else dtype
+        buffer = self.buffers.get(name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.zeros(shape, dtype=dtype)
+            self.buffers[name] = buffer
+        return buffer
+
+    def constant(self, name, factory):
+        """
+        Returns the array made by factory() the first time name is requested,
+        for lookup tables that only depend on the key.
+        """
+        array = self.buffers.get(name)
+        if array is None:
+            array = factory()
+            self.buffers[name] = array
+        return array
+
+    def nbytes(self):
+        return sum(buffer.nbytes for buffer in self.buffers.values())
+
+def allocations_per_tick(tick, ticks=100, warmup=10):
+    """
+    Measures the largest number of bytes allocated during one call of tick
+    once the work buffers have warmed up.
+
+    Example::
+
+        planner = GaussianPlanner(show_plot=False)
+        assert allocations_per_tick(lambda: planner.step(scan)) < 64 * 1024
+    """
+    for _ in range(warmup):
+        tick()
+
+    tracemalloc.start()
+    try:
+        worst = 0
+        for _ in range(ticks):
+            tracemalloc.reset_peak()
+            start, _ = tracemalloc.get_traced_memory()
+            tick()
+            _, peak = tracemalloc.get_traced_memory()
+            worst = max(worst, peak - start)
+    finally:
+        tracemalloc.stop()
+    return worst